@@ -28,6 +28,7 @@ def main():
     print("Generated files:")
     print("- network_evaluate.c: Neural network implementation in C")
     print("- params.pkl: Original model parameters (backup)")
+    print("- params.npz: Model parameters converted to numpy arrays")
 
 
 if __name__ == "__main__":
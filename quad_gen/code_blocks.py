@@ -13,6 +13,25 @@ headers_network_evaluate = """
 
 """
 
+raw_state_note = """
+// state_array is the raw, un-normalized state: the observation
+// normalization (x - mean) / std is folded into the generated tables
+
+"""
+
+headers_neon = """
+#ifdef __ARM_NEON
+#include <arm_neon.h>
+// vfmaq_f32 needs VFPv4/ARMv8, older NEON units multiply and add separately
+#ifdef __ARM_FEATURE_FMA
+#define NEON_FMA(acc, a, b) vfmaq_f32(acc, a, b)
+#else
+#define NEON_FMA(acc, a, b) vmlaq_f32(acc, a, b)
+#endif
+#endif
+
+"""
+
 constants = """
 
 #define MAX_THRUST 0.1597
@@ -65,6 +84,34 @@ float relu(float num) {
 
 """
 
+fast_tanh_activation = """
+
+static inline float fast_tanhf(float x) {
+	// Pade approximant of tanh, clamped at +-3 where it reaches exactly +-1,
+	// lossy: up to 0.024 absolute error (near |x| = 1.57)
+	x = fmaxf(-3.0f, fminf(3.0f, x));
+	float x2 = x * x;
+	return x * (27.0f + x2) / (27.0f + 9.0f * x2);
+}
+
+"""
+
+# expects the float table tanh_lut[1025], tanh(-4 + i / 128), to be defined before it
+tanh_lut_activation = """
+
+static inline float tanh_lut_lookup(float x) {
+	// linear interpolation in tanh_lut over [-4, 4], clamped to its end points,
+	// the comparisons fail for NaN so it never reaches the index computation
+	float s = x * 128.0f + 512.0f;
+	if (!(s > 0.0f)) return tanh_lut[0];
+	if (!(s < 1024.0f)) return tanh_lut[1024];
+	int i = (int)s;
+	float f = s - (float)i;
+	return tanh_lut[i] + (tanh_lut[i + 1] - tanh_lut[i]) * f;
+}
+
+"""
+
 scaling = """
 // range of action -1 ... 1, need to scale to range 0 .. 1
 float scale(float v) {
@@ -198,13 +245,71 @@ void thrusts2PWM(struct control_t_n *control_n,
 
 """
 
-log_group = """
+headers_fixed_width = """
+#include <stdint.h>
+
+"""
+
+int8_quantization = """
+
+static inline int8_t quantize_int8(float v) {
+	// round to nearest and saturate to the symmetric int8 range, the
+	// comparisons fail for NaN so it saturates instead of reaching the cast
+	if (!(v < 127.0f)) return 127;
+	if (!(v > -127.0f)) return -127;
+	return (int8_t)(v < 0 ? v - 0.5f : v + 0.5f);
+}
+
+"""
+
+fixed_point_helpers = """
+
+static inline int16_t float_to_q12(float v) {
+	// round to nearest and saturate to Q4.12, the comparisons fail for NaN
+	// so it saturates instead of reaching the cast
+	float s = v * 4096.0f;
+	if (!(s < 32767.0f)) return 32767;
+	if (!(s > -32767.0f)) return -32767;
+	return (int16_t)(s < 0 ? s - 0.5f : s + 0.5f);
+}
+
+static inline int16_t tanh_q15_lookup(int32_t z) {
+	// z is Q.12, tanh_q15 covers [-4, 4) in steps of 1/32 (128 units of z)
+	int32_t s = z + (4 << 12);
+	if (s <= 0) return tanh_q15[0];
+	if (s >= (255 << 7)) return tanh_q15[255];
+	int32_t i = s >> 7;
+	int32_t f = s & 127;
+	return (int16_t)(tanh_q15[i] + (((tanh_q15[i + 1] - tanh_q15[i]) * f) >> 7));
+}
+
+"""
+
 
-LOG_GROUP_START(ctrlNN)
-LOG_ADD(LOG_FLOAT, thrust0, &output_2[0])
-LOG_ADD(LOG_FLOAT, thrust1, &output_2[1])
-LOG_ADD(LOG_FLOAT, thrust2, &output_2[2])
-LOG_ADD(LOG_FLOAT, thrust3, &output_2[3])
-LOG_GROUP_STOP(ctrlNN)
+# inner row update of a float layer, format with tabs, output and n_cols
+# (a multiple of 4), expects the scalar `a` and the weight row `w` in scope
+neon_matmul_kernel = """
+{tabs}float32x4_t va = vdupq_n_f32(a);
+{tabs}for (int i = 0; i < {n_cols}; i += 4) {{
+{tabs}	float32x4_t vo = vld1q_f32(&{output}[i]);
+{tabs}	vst1q_f32(&{output}[i], NEON_FMA(vo, va, vld1q_f32(&w[i])));
+{tabs}}}
+"""
 
-"""
\ No newline at end of file
+# build script of the binary weights, format with names (space separated array names)
+objcopy_build_script = """#!/bin/sh
+# Convert the raw little-endian tables referenced by the extern declarations of
+# network_evaluate.c into objects to link with it, every table is placed in
+# .rodata aligned to 32 bytes under the symbol name of the array (GNU objcopy
+# aligns by the input section name, llvm-objcopy by the renamed one)
+set -e
+cd "$(dirname "$0")"
+OBJCOPY="${{OBJCOPY:-arm-none-eabi-objcopy}}"
+for name in {names}; do
+	"$OBJCOPY" -I binary -O elf32-littlearm -B arm \\
+		--rename-section .data=.rodata,alloc,load,readonly,data,contents \\
+		--set-section-alignment .data=32 --set-section-alignment .rodata=32 \\
+		--redefine-sym "_binary_${{name}}_bin_start=${{name}}" \\
+		"${{name}}.bin" "${{name}}.o"
+done
+"""
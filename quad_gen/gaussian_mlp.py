@@ -1,30 +1,438 @@
 import argparse
+import contextlib
+import io
 import numpy as np 
 import os
-from typing import List, Optional, Any
-
-
-# Import TensorFlow
-import tensorflow as tf
+from typing import IO, Iterator, List, Optional, Any
 
 from quad_gen.code_blocks import (
 	headers_network_evaluate,
 	linear_activation,
 	sigmoid_activation,
 	relu_activation,
+	fast_tanh_activation,
+	tanh_lut_activation,
+	headers_fixed_width,
+	int8_quantization,
+	fixed_point_helpers,
+	headers_neon,
+	neon_matmul_kernel,
+	objcopy_build_script,
+	raw_state_note,
 )
 
+# unroll factor of the emitted inner matmul loop
+UNROLL = 4
+
+# float lanes of the vector kernels
+SIMD_WIDTH = 4
+# alignment in bytes of every emitted table and output buffer (one AVX register)
+ALIGNMENT = 32
+# layer widths are padded to a multiple of this many elements, a multiple of
+# SIMD_WIDTH that keeps every float weight row ALIGNMENT aligned
+LAYER_PAD = ALIGNMENT // 4
+
+# little-endian numpy dtype of each table type written by emit_binary
+BINARY_DTYPES = {"float": "<f4", "int8_t": "<i1", "int16_t": "<i2", "int32_t": "<i4"}
+
+# numeric formats generate() can emit
+PRECISIONS = ("float", "int8", "fixed")
+
+# number of outputs of the last layer networkEvaluate writes to control_n
+N_OUTPUTS = 4
+# C type of the hidden activations of each precision
+ACTIVATION_TYPES = {"float": "float", "int8": "int8_t", "fixed": "int16_t"}
+# C type of the layer accumulator of the quantized precisions
+ACCUMULATOR_TYPES = {"int8": "int32_t", "fixed": "int32_t"}
+
+# tanh implementations of the float and int8 paths and the C function each one calls
+TANH_FUNCTIONS = {
+	"tanhf": "tanhf",
+	"fast": "fast_tanhf",
+	"lut": "tanh_lut_lookup",
+}
+# the float tanh table of the "lut" tanh covers [-4, 4] in steps of 1/128
+TANH_LUT_SIZE = 1025
+
+"""
+Fixed point formats of the "fixed" precision, as fractional bits:
+the state is converted to Q4.12 (saturating outside [-8, 8)), tanh
+outputs are Q1.15 and pre-activations (accumulator after the shift,
+biases, network outputs) are Q.12 in int32. Weights get a per-layer
+Q format that also keeps the int32 accumulator from overflowing, see
+weight_frac_bits
+"""
+STATE_FRAC_BITS = 12
+HIDDEN_FRAC_BITS = 15
+PRE_FRAC_BITS = 12
+# the tanh table covers [-4, 4) in steps of 1/32
+TANH_Q15_SIZE = 256
+
+
+@contextlib.contextmanager
+def replace_atomically(path: str, mode: str = 'w') -> Iterator[IO]:
+	"""
+	Open a temporary file next to path, private to this process, and move it
+	over path once it is written, so concurrent writers of the same path and
+	their readers never see a partially written file
+	Args:
+		path [str]: the file to write
+		mode [str]: (default 'w') the open mode, 'w' or 'wb'
+	Returns:
+		Iterator[IO]: the temporary file
+	"""
+	tmp_path = f"{path}.{os.getpid()}.tmp"
+	try:
+		with open(tmp_path, mode) as f:
+			yield f
+		os.replace(tmp_path, path)
+	finally:
+		if os.path.exists(tmp_path):
+			os.remove(tmp_path)
+
+
+def unrolled_row_update(row: str, output: str, n_cols: int, weight_type: str = "float") -> str:
+	"""
+	Generate the inner loop of a layer, output[i] += a * w[i] over one weight
+	row, manually unrolled by UNROLL with a scalar tail. Float rows whose
+	width is a multiple of SIMD_WIDTH also get a NEON kernel behind __ARM_NEON
+	Args:
+		row [str]: C expression of the address of the first weight of the row
+		output [str]: the name of the array being accumulated into
+		n_cols [int]: the number of columns swept (known at codegen time)
+		weight_type [str]: the C type of the weight array
+	Returns:
+		str: the generated source code, expects `a` to be in scope
+	"""
+	tabs = "\t" * 3
+	body = f"""
+{tabs}const {weight_type} *w = {row};"""
+	neon = weight_type == "float" and n_cols % SIMD_WIDTH == 0
+	if neon:
+		body += "\n#ifdef __ARM_NEON"
+		body += neon_matmul_kernel.format(tabs=tabs, output=output, n_cols=n_cols)
+		body += "#else"
+	body += f"""
+{tabs}int i = 0;"""
+	n_main = n_cols - n_cols % UNROLL
+	if n_main:
+		body += f"""
+{tabs}for (; i < {n_main}; i += {UNROLL}) {{"""
+		for u in range(UNROLL):
+			idx = f"i + {u}" if u else "i"
+			body += f"""
+{tabs}	{output}[{idx}] += a * w[{idx}];"""
+		body += f"""
+{tabs}}}"""
+	if n_cols % UNROLL:
+		body += f"""
+{tabs}for (; i < {n_cols}; i++) {{
+{tabs}	{output}[i] += a * w[i];
+{tabs}}}"""
+	if neon:
+		body += "\n#endif"
+	return body
+
+
+def matmul_loops(
+	n: int,
+	layer_input: str,
+	output: str,
+	n_in: int,
+	n_out: int,
+	weight_type: str = "float",
+) -> str:
+	"""
+	Generate output += input * W for one layer in (k, i) order: the outer loop
+	walks the inputs and the inner loop sweeps one contiguous row of the
+	[in][out] weight matrix. Every weight is used once, so the weights
+	stream through in storage order and are not cache blocked
+	Args:
+		n [int]: the index of the layer
+		layer_input [str]: the name of the array holding the layer input
+		output [str]: the name of the array being accumulated into
+		n_in [int]: the number of inputs of the layer
+		n_out [int]: the number of outputs of the layer
+		weight_type [str]: the C type of the weight array
+	Returns:
+		str: the generated source code
+	"""
+	input_type = "float" if weight_type == "float" else "int32_t"
+	return f"""
+		for (int k = 0; k < {n_in}; k++) {{
+			{input_type} a = {layer_input}[k];{unrolled_row_update(f"&layer_{n}_weight[k * {n_out}]", output, n_out, weight_type)}
+		}}"""
+
+
+def float_layer(n: int, layer_input: str, output: str, n_in: int, n_out: int, activation: Optional[str]) -> str:
+	"""
+	Generate one float layer, output_n = tanh(input * W + b), with the
+	outputs initialized to the bias so they are swept only once more for tanh
+	Args:
+		n [int]: the index of the layer
+		layer_input [str]: the name of the array holding the layer input
+		output [str]: the name of the array the layer writes
+		n_in [int]: the number of inputs of the layer
+		n_out [int]: the number of outputs of the layer
+		activation [str, optional]: the C tanh function applied to the layer output,
+			None for a linear layer
+	Returns:
+		str: the generated source code
+	"""
+	code = f"""
+		for (int i = 0; i < {n_out}; i++) {{
+			{output}[i] = layer_{n}_bias[i];
+		}}{matmul_loops(n, layer_input, output, n_in, n_out)}"""
+	if activation:
+		code += f"""
+		for (int i = 0; i < {n_out}; i++) {{
+			{output}[i] = {activation}({output}[i]);
+		}}"""
+	code += """
+	"""
+	return code
+
+
+def transposed_float_layer(n: int, layer_input: str, output: str, n_in: int, n_out: int, activation: Optional[str]) -> str:
+	"""
+	Generate one float layer in the original (i, j) order over a pre-transposed
+	[out][in] weight matrix: each output is one unit-stride dot product summed
+	in the same order as the original loop, bias added last
+	Args:
+		n [int]: the index of the layer
+		layer_input [str]: the name of the array holding the layer input
+		output [str]: the name of the array the layer writes
+		n_in [int]: the number of inputs of the layer
+		n_out [int]: the number of outputs of the layer
+		activation [str, optional]: the C tanh function applied to the layer output,
+			None for a linear layer
+	Returns:
+		str: the generated source code
+	"""
+	code = f"""
+		for (int i = 0; i < {n_out}; i++) {{
+			const float *w = &layer_{n}_weight[i * {n_in}];
+			float acc = 0;
+			for (int j = 0; j < {n_in}; j++) {{
+				acc += {layer_input}[j] * w[j];
+			}}
+			{output}[i] = acc + layer_{n}_bias[i];"""
+	if activation:
+		code += f"""
+			{output}[i] = {activation}({output}[i]);"""
+	code += """
+		}
+	"""
+	return code
+
+
+def int8_layer(n: int, layer_input: str, output: str, input_scale: str, n_in: int, n_out: int, activation: Optional[str]) -> str:
+	"""
+	Generate one int8 layer: int8 x int8 products are accumulated in the int32
+	array acc shared by the layers, dequantized once per output, biased and,
+	for hidden layers, passed through tanh and requantized to int8 for the
+	next layer
+	Args:
+		n [int]: the index of the layer
+		layer_input [str]: the name of the int8 array holding the layer input
+		output [str]: the name of the int8 array the layer writes, a float array
+			for the linear layer
+		input_scale [str]: C expression of the real value of one input unit
+		n_in [int]: the number of inputs of the layer
+		n_out [int]: the number of outputs of the layer
+		activation [str, optional]: the C tanh function applied before the output is
+			requantized, None for a linear float layer
+	Returns:
+		str: the generated source code
+	"""
+	code = f"""
+		for (int i = 0; i < {n_out}; i++) {{
+			acc[i] = 0;
+		}}{matmul_loops(n, layer_input, "acc", n_in, n_out, "int8_t")}
+		const float dq_{n} = {input_scale} * layer_{n}_scale;
+		for (int i = 0; i < {n_out}; i++) {{"""
+	if activation:
+		code += f"""
+			{output}[i] = quantize_int8(127.0f * {activation}(acc[i] * dq_{n} + layer_{n}_bias[i]));"""
+	else:
+		code += f"""
+			{output}[i] = acc[i] * dq_{n} + layer_{n}_bias[i];"""
+	code += """
+		}
+	"""
+	return code
+
+
+def hex_float(num: float) -> str:
+	"""
+	Format a float32 value as the shortest C99 hex float literal, e.g. 0x1.8p-3f,
+	which is exact and needs no decimal conversion when it is compiled
+	Args:
+		num [float]: the value, exactly representable as a float32
+	Returns:
+		str: the C literal
+	"""
+	if not np.isfinite(num):
+		raise ValueError(f"Cannot emit the non-finite value {num} as a C float literal")
+	mantissa, exponent = float(num).hex().split("p")
+	mantissa = mantissa.rstrip("0").rstrip(".")
+	return f"{mantissa}p{exponent.lstrip('+')}f"
+
 
-def generate(policy: Any, sess: Any, output_path: Optional[str] = None) -> str:
+def c_array(c_type: str, name: str, values: np.ndarray) -> str:
+	"""
+	Generate the definition of a flat constant C array
+	Args:
+		c_type [str]: the C element type
+		name [str]: the name of the array
+		values [np.ndarray]: the values, flattened in row-major order
+	Returns:
+		str: the generated source code
+	"""
+	flat = np.asarray(values).ravel()
+	if np.issubdtype(flat.dtype, np.floating):
+		if not np.isfinite(flat).all():
+			raise ValueError(f"{name} holds non-finite values")
+		body = ",".join([hex_float(v) for v in flat.astype(np.float32).tolist()])
+	else:
+		body = ",".join(map(str, flat.tolist()))
+	return f"""static const {c_type} __attribute__((aligned({ALIGNMENT}))) {name}[{flat.size}] = {{{body}}};\n"""
+
+
+def binary_array(c_type: str, name: str, values: np.ndarray, out_dir: str) -> str:
+	"""
+	Write a constant array to the raw little-endian file out_dir/name.bin, to be
+	linked through objcopy, and generate its extern declaration
+	Args:
+		c_type [str]: the C element type
+		name [str]: the name of the array
+		values [np.ndarray]: the values, flattened in row-major order
+		out_dir [str]: the directory of the .bin file
+	Returns:
+		str: the generated source code
+	"""
+	flat = np.asarray(values).ravel()
+	data = flat.astype(BINARY_DTYPES[c_type])
+	if np.issubdtype(data.dtype, np.floating) and not np.isfinite(data).all():
+		raise ValueError(f"{name} holds non-finite values")
+	with replace_atomically(os.path.join(out_dir, f"{name}.bin"), 'wb') as f:
+		f.write(data.tobytes())
+	return f"""extern const {c_type} __attribute__((aligned({ALIGNMENT}))) {name}[{flat.size}];\n"""
+
+
+def weight_frac_bits(mat: np.ndarray, vec: np.ndarray, input_frac_bits: int) -> int:
+	"""
+	Pick the number of fractional bits of an int16 weight matrix, i.e. the
+	largest f such that every weight fits in Q(15-f).f and the int32
+	accumulator of fixed_layer cannot overflow: with every input at most
+	32767 in magnitude, the scaled bias, the rounding term and the largest
+	column sum of |w_q| * 32767 must stay below 2^31
+	Args:
+		mat [np.ndarray]: the float weights
+		vec [np.ndarray]: the float biases
+		input_frac_bits [int]: the fractional bits of the layer input
+	Returns:
+		int: the number of fractional bits
+	"""
+	bias_q = np.abs(np.round(vec.astype(np.float64) * 2**PRE_FRAC_BITS)).astype(np.int64)
+	for frac_bits in range(15, -1, -1):
+		mat_q = np.abs(np.round(mat.astype(np.float64) * 2**frac_bits)).astype(np.int64)
+		if mat_q.max() > 32767:
+			continue
+		shift = input_frac_bits + frac_bits - PRE_FRAC_BITS
+		bound = 32767 * mat_q.sum(axis=0) + (bias_q << max(shift, 0)) + (1 << max(shift - 1, 0))
+		if bound.max() < 2**31:
+			return frac_bits
+	raise ValueError(f"Weights of magnitude {float(np.max(np.abs(mat)))} cannot be accumulated in int32")
+
+
+def fixed_layer(n: int, layer_input: str, output: str, shift: int, n_in: int, n_out: int, activation: bool) -> str:
+	"""
+	Generate one fixed point layer: int16 x int16 products are accumulated in
+	the int32 array acc shared by the layers on top of the bias scaled to the
+	accumulator format, shifted down to Q.12 and, for hidden layers, passed
+	through the Q1.15 tanh table, the linear layer converts its Q.12 outputs
+	to float. The scaled bias is a multiple of 1 << shift, so this is exact,
+	and weight_frac_bits keeps the sums within int32
+	Args:
+		n [int]: the index of the layer
+		layer_input [str]: the name of the int16 array holding the layer input
+		output [str]: the name of the int16 array the layer writes, a float array
+			for the linear layer
+		shift [int]: input frac bits + weight frac bits - PRE_FRAC_BITS
+		n_in [int]: the number of inputs of the layer
+		n_out [int]: the number of outputs of the layer
+		activation [bool]: whether to apply tanh to the layer output
+	Returns:
+		str: the generated source code
+	"""
+	rounding = f"(1 << {shift - 1})" if shift > 0 else "0"
+	code = f"""
+		for (int i = 0; i < {n_out}; i++) {{
+			acc[i] = layer_{n}_bias[i] * (1 << {shift});
+		}}{matmul_loops(n, layer_input, "acc", n_in, n_out, "int16_t")}
+		for (int i = 0; i < {n_out}; i++) {{
+			int32_t z = (acc[i] + {rounding}) >> {shift};"""
+	if activation:
+		code += f"""
+			{output}[i] = tanh_q15_lookup(z);"""
+	else:
+		code += f"""
+			{output}[i] = z * (1.0f / {2**PRE_FRAC_BITS});"""
+	code += """
+		}
+	"""
+	return code
+
+
+def generate(
+	policy: Any,
+	sess: Any,
+	output_path: Optional[str] = None,
+	precision: str = "float",
+	tanh: str = "lut",
+	transpose: bool = False,
+	input_mean: Optional[np.ndarray] = None,
+	input_std: Optional[np.ndarray] = None,
+	emit_binary: bool = False,
+) -> str:
 	"""
 	Generate mlp model source code given a policy object
 	Args:
 		policy [policy object]: the trained policy (can be JAX/Flax params or TensorFlow)
-		sess [tf.compat.v1.Session]: a tensorflow session
+		sess [tf.compat.v1.Session]: a tensorflow session, only used by TensorFlow
+			policies and None for JAX/Flax parameters
 		output_path [str, optional]: the path of the generated code (should include the file name)
+		precision [str]: (default "float") numeric format of the generated network,
+			"float" for float32 weights, "int8" for per-layer int8 weights and activations
+			or "fixed" for an integer only Q format network
+		tanh [str]: (default "lut") tanh of the float and int8 paths, "tanhf" for libm,
+			"fast" for the clamped Pade approximant fast_tanhf or "lut" for linear
+			interpolation in a TANH_LUT_SIZE entry table
+		transpose [bool]: (default False) keep the original output-major loop order of
+			the float path and emit the weights pre-transposed to [out][in] so its
+			inner loop is unit-stride, bit-exact with the original generator with
+			tanh="tanhf" and no input_mean/input_std
+		input_mean [np.ndarray, optional]: per input mean of the observation normalizer
+		input_std [np.ndarray, optional]: per input std of the observation normalizer,
+			when both are given (x - mean) / std is folded into the first layer and
+			networkEvaluate takes the raw state
+		emit_binary [bool]: (default False) write the weights and biases to raw
+			little-endian .bin files next to output_path, declared extern in the
+			generated code, together with a build.sh that links them with objcopy
 	Returns:
 		str: the generated source code
 	"""
+	if precision not in PRECISIONS:
+		raise ValueError(f"Invalid precision: {precision}. Must be one of {PRECISIONS}.")
+	if tanh not in TANH_FUNCTIONS:
+		raise ValueError(f"Invalid tanh: {tanh}. Must be one of {tuple(TANH_FUNCTIONS)}.")
+	tanh_fn = TANH_FUNCTIONS[tanh]
+	if transpose and precision != "float":
+		raise ValueError("transpose only applies to the float precision")
+	if emit_binary and not output_path:
+		raise ValueError("emit_binary needs an output_path to write the .bin files next to")
+
 	# Handle JAX/Flax parameter structure
 	if hasattr(policy, 'get') and callable(policy.get):
 		# This is likely a JAX/Flax FrozenDict or similar
@@ -62,148 +470,222 @@ def generate(policy: Any, sess: Any, output_path: Optional[str] = None) -> str:
 	the # of layers must be subtracted by 1
 	"""
 	n_layers = len(trainable_shapes) - 1
-	weights: List[str] = []	# strings
-	biases: List[str] = []		# strings
-	outputs: List[str] = []	# strings
+	# split the trainables into the weight matrices and the bias vectors of the layers
+	kernels: List[np.ndarray] = []
+	bias_vecs: List[np.ndarray] = []
+	for n in range(n_layers):
+		if len(trainable_shapes[n]) == 2:
+			kernels.append(np.asarray(trainable_evals[n], dtype=np.float32))
+		elif len(trainable_shapes[n]) == 1:
+			bias_vecs.append(np.asarray(trainable_evals[n], dtype=np.float32))
+	# a diverged checkpoint would emit inf / nan, which are not C literals
+	for n, (mat, vec) in enumerate(zip(kernels, bias_vecs)):
+		if not (np.isfinite(mat).all() and np.isfinite(vec).all()):
+			raise ValueError(f"Layer {n} has non-finite weights or biases, the checkpoint may have diverged")
 
-	structure = f"""static const int structure[{int(n_layers/2 + 1)}][2] = {{""" # structure code thingy
+	# index of the last layer used by networkEvaluate
+	last = int(n_layers/2) - 1
 
-	n_weight = 0
-	n_bias = 0
-	for n in range(n_layers): 
-		shape = trainable_shapes[n]
-		
-		if len(shape) == 2:
-			# it is a weight matrix
-			weight = f"""static const float layer_{n_weight}_weight[{shape[0]}][{shape[1]}] = {{"""
-			for row in trainable_evals[n]:
-				weight += """{"""
-				for num in row:
-					weight += f"{num},"
-				# get rid of the comma after the last number
-				weight = weight[:-1]
-				weight += """},"""
-			# get rid of the comma after the last curly bracket
-			weight = weight[:-1]
-			weight += """};\n"""
-			weights.append(weight)
-			n_weight += 1
-
-			# augment the structure array
-			structure += f"""{{{shape[0]}, {shape[1]}}},"""
-
-		elif len(shape) == 1:
-			# it is a bias vector 
-			bias = f"""static const float layer_{n_bias}_bias[{shape[0]}] = {{"""
-			for num in trainable_evals[n]:
-				bias += f"{num},"
-			# get rid of the comma after the last number
-			bias = bias[:-1]
-			bias += """};\n"""
-			biases.append(bias)
-
-			# add the output arrays
-			output = f"""static float output_{n_bias}[{shape[0]}];\n"""
-			outputs.append(output)
-
-			n_bias += 1
-
-	# complete the structure array
-	# get rid of the comma after the last curly bracket
-	structure = structure[:-1] 
-	structure += """};\n"""
+	"""
+	Fold the observation normalization into the first layer of the float path:
+	((x - mean) / std) W + b = x (W / std) + (b - (mean / std) W)
+	The quantized paths must quantize the normalized state, raw inputs with a
+	small std would vanish in the quantization step, so they fold it into the
+	float to integer conversion of the state instead
+	"""
+	normalized = input_mean is not None and input_std is not None
+	if normalized:
+		mean = np.asarray(input_mean, dtype=np.float64)
+		std = np.asarray(input_std, dtype=np.float64)
+		if precision == "float":
+			w0 = kernels[0].astype(np.float64)
+			kernels[0] = (w0 / std[:, None]).astype(np.float32)
+			bias_vecs[0] = (bias_vecs[0] - (mean / std) @ w0).astype(np.float32)
+
+	# only the first N_OUTPUTS outputs of the last layer reach control_n,
+	# the others are never computed
+	kernels[last] = kernels[last][:, :N_OUTPUTS]
+	bias_vecs[last] = bias_vecs[last][:N_OUTPUTS]
+
+	# pad the outputs of the hidden layers to a multiple of LAYER_PAD with zero
+	# weights and biases, so the vector kernels need no scalar tail and every
+	# weight row starts aligned; padded outputs stay 0 through tanh. The last
+	# layer keeps its N_OUTPUTS (one SIMD_WIDTH vector) outputs, written straight
+	# into control_n. The transposed layout sweeps the inputs in its inner loop,
+	# so its layers after the first also get zero weights for the padded inputs,
+	# the (k, i) layouts sweep the outputs and would only do more work over zero rows
+	for n in range(last + 1):
+		if n < last:
+			pad = -kernels[n].shape[1] % LAYER_PAD
+			kernels[n] = np.pad(kernels[n], ((0, 0), (0, pad)))
+			bias_vecs[n] = np.pad(bias_vecs[n], (0, pad))
+		if transpose and n > 0:
+			in_pad = kernels[n - 1].shape[1] - kernels[n].shape[0]
+			kernels[n] = np.pad(kernels[n], ((0, in_pad), (0, 0)))
+
+	# the whole file is written into one buffer
+	source = io.StringIO()
+	# headers
+	source.write(headers_network_evaluate)
+	if normalized:
+		source.write(raw_state_note)
+	if precision == "float":
+		source.write(headers_neon)
+	if precision in ("int8", "fixed"):
+		source.write(headers_fixed_width)
+	# helper functions
+	source.write(linear_activation)
+	source.write(sigmoid_activation)
+	source.write(relu_activation)
+	if precision != "fixed" and tanh == "fast":
+		source.write(fast_tanh_activation)
+	elif precision != "fixed" and tanh == "lut":
+		xs = np.linspace(-4, 4, TANH_LUT_SIZE)
+		source.write(c_array("float", "tanh_lut", np.tanh(xs).astype(np.float32)))
+		source.write(tanh_lut_activation)
+	if precision == "int8":
+		source.write(int8_quantization)
+	elif precision == "fixed":
+		# tanh table in Q1.15, entry i holds tanh(-4 + i / 32)
+		xs = -4 + np.arange(TANH_Q15_SIZE) / 32
+		source.write(c_array("int16_t", "tanh_q15", np.round(np.tanh(xs) * 32767).astype(np.int16)))
+		source.write(fixed_point_helpers)
+
+	# the weights and biases are inline initializers or extern tables in .bin files
+	if emit_binary:
+		out_dir = os.path.dirname(output_path) or "."
+		table_names: List[str] = []
+		def emit_array(c_type: str, name: str, values: np.ndarray) -> str:
+			table_names.append(name)
+			return binary_array(c_type, name, values, out_dir)
+	else:
+		emit_array = c_array
+
+	# the weight matrices, stored flat in row-major [in][out] order
+	# fractional bits of each weight matrix of the fixed point path
+	frac_bits: List[int] = []
+	for n, mat in enumerate(kernels):
+		if precision == "int8":
+			# symmetric per-layer quantization, w ~= layer_n_scale * w_q
+			max_abs = float(np.max(np.abs(mat)))
+			scale = max_abs / 127 if max_abs > 0 else 1.0
+			source.write(f"""static const float layer_{n}_scale = {scale};\n""")
+			mat_q = np.clip(np.round(mat / scale), -127, 127).astype(np.int8)
+			source.write(emit_array("int8_t", f"layer_{n}_weight", mat_q))
+		elif precision == "fixed":
+			input_frac_bits = STATE_FRAC_BITS if n == 0 else HIDDEN_FRAC_BITS
+			# the trailing matrix has no bias vector, see n_layers
+			vec = bias_vecs[n] if n < len(bias_vecs) else np.zeros(mat.shape[1])
+			frac_bits.append(weight_frac_bits(mat, vec, input_frac_bits))
+			mat_q = np.round(mat * 2**frac_bits[-1]).astype(np.int16)
+			source.write(emit_array("int16_t", f"layer_{n}_weight", mat_q))
+		else:
+			# the transposed layout stores every output's weights contiguously
+			source.write(emit_array("float", f"layer_{n}_weight", mat.T if transpose and n <= last else mat))
+
+	# the bias vectors
+	for n, vec in enumerate(bias_vecs):
+		if precision == "fixed":
+			vec_q = np.round(vec * 2**PRE_FRAC_BITS).astype(np.int32)
+			source.write(emit_array("int32_t", f"layer_{n}_bias", vec_q))
+		else:
+			source.write(emit_array("float", f"layer_{n}_bias", vec))
+
+	# the normalized state as an expression of k
+	state = "state_array[k]"
+	if normalized and precision != "float":
+		source.write(c_array("float", "input_norm_scale", (1 / std).astype(np.float32)))
+		source.write(c_array("float", "input_norm_offset", (-mean / std).astype(np.float32)))
+		state = "(state_array[k] * input_norm_scale[k] + input_norm_offset[k])"
+
+	# construct the network evaluation function
+	source.write("""
+	void networkEvaluate(float *__restrict__ state_array, float *__restrict__ control_n) {
+	""")
+
+	# the hidden activations ping-pong between two stack buffers, the last
+	# layer writes control_n directly
+	buffers = ("buf_a", "buf_b")
+	if last > 0:
+		max_width = max(kernels[n].shape[1] for n in range(last))
+		for buffer in buffers:
+			source.write(f"""
+		{ACTIVATION_TYPES[precision]} __attribute__((aligned({ALIGNMENT}))) {buffer}[{max_width}];""")
+	# the quantized layers share one accumulator sized to the widest layer
+	if precision in ACCUMULATOR_TYPES:
+		acc_width = max(kernels[n].shape[1] for n in range(last + 1))
+		source.write(f"""
+		{ACCUMULATOR_TYPES[precision]} __attribute__((aligned({ALIGNMENT}))) acc[{acc_width}];""")
+	source.write("\n")
 
 	"""
 	Multiple for loops to do matrix multiplication
 	 - assuming using tanh activation
 	"""
-	for_loops: List[str] = []	# strings 
-
-	# the first hidden layer
-	input_for_loop = """
-		for (int i = 0; i < structure[0][1]; i++) {
-			output_0[i] = 0;
-			for (int j = 0; j < structure[0][0]; j++) {
-				output_0[i] += state_array[j] * layer_0_weight[j][i];
-			}
-			output_0[i] += layer_0_bias[i];
-			output_0[i] = tanhf(output_0[i]);
-		}
-	"""
-	for_loops.append(input_for_loop)
-
-	# rest of the hidden layers
-	for n in range(1, int(n_layers/2)-1):
-		for_loop = f"""
-		for (int i = 0; i < structure[{n}][1]; i++) {{
-			output_{n}[i] = 0;
-			for (int j = 0; j < structure[{n}][0]; j++) {{
-				output_{n}[i] += output_{n-1}[j] * layer_{n}_weight[j][i];
-			}}
-			output_{n}[i] += layer_{n}_bias[i];
-			output_{n}[i] = tanhf(output_{n}[i]);
+	if precision == "int8":
+		# quantize the state with a per call symmetric scale
+		n_in = kernels[0].shape[0]
+		source.write(f"""
+		float state[{n_in}];
+		float in_scale = 0;
+		for (int k = 0; k < {n_in}; k++) {{
+			state[k] = {state};
+			float m = fabsf(state[k]);
+			if (m > in_scale) in_scale = m;
 		}}
-		"""
-		for_loops.append(for_loop)
-
-	n = int(n_layers/2)-1
-	# the last hidden layer which is supposed to have no non-linearity
-	output_for_loop = f"""
-		for (int i = 0; i < structure[{n}][1]; i++) {{
-			output_{n}[i] = 0;
-			for (int j = 0; j < structure[{n}][0]; j++) {{
-				output_{n}[i] += output_{n-1}[j] * layer_{n}_weight[j][i];
-			}}
-			output_{n}[i] += layer_{n}_bias[i];
+		in_scale = in_scale > 0 ? in_scale / 127.0f : 1.0f;
+		int8_t input_q[{n_in}];
+		for (int k = 0; k < {n_in}; k++) {{
+			input_q[k] = quantize_int8(state[k] / in_scale);
 		}}
-		"""
-	for_loops.append(output_for_loop)
-
-	# assign network outputs to control
-	assignment = f"""
-		control_n[0] = output_{n}[0];
-		control_n[1] = output_{n}[1];
-		control_n[2] = output_{n}[2];
-		control_n[3] = output_{n}[3];	
-	"""
+		""")
+	elif precision == "fixed":
+		# the state is the only float input, convert it once
+		n_in = kernels[0].shape[0]
+		source.write(f"""
+		// the state is converted to Q4.12, values outside [-8, 8) saturate
+		int16_t input_q[{n_in}];
+		for (int k = 0; k < {n_in}; k++) {{
+			input_q[k] = float_to_q12({state});
+		}}
+		""")
 
-	# construct the network evaluation function
-	controller_eval = """
-	void networkEvaluate(float *state_array, float *control_n) {
-	"""
-	for code in for_loops:
-		controller_eval += code 
-	# assignment to control_n
-	controller_eval += assignment
+	for n in range(last + 1):
+		n_in, n_out = kernels[n].shape
+		layer_input = buffers[(n - 1) % 2]
+		layer_output = "control_n" if n == last else buffers[n % 2]
+		# the last layer is supposed to have no non-linearity
+		if precision == "int8":
+			if n == 0:
+				layer_input = "input_q"
+			# hidden activations are tanh outputs quantized with a fixed 1/127 scale
+			input_scale = "in_scale" if n == 0 else "(1.0f / 127)"
+			source.write(int8_layer(n, layer_input, layer_output, input_scale, n_in, n_out, tanh_fn if n != last else None))
+		elif precision == "fixed":
+			if n == 0:
+				layer_input = "input_q"
+			input_frac_bits = STATE_FRAC_BITS if n == 0 else HIDDEN_FRAC_BITS
+			shift = input_frac_bits + frac_bits[n] - PRE_FRAC_BITS
+			source.write(fixed_layer(n, layer_input, layer_output, shift, n_in, n_out, n != last))
+		else:
+			if n == 0:
+				layer_input = "state_array"
+			emit_layer = transposed_float_layer if transpose else float_layer
+			source.write(emit_layer(n, layer_input, layer_output, n_in, n_out, tanh_fn if n != last else None))
 
 	# closing bracket
-	controller_eval += """
+	source.write("""
 	}
-	"""
-
-	# combine the all the codes
-	source = ""
-	# headers
-	source += headers_network_evaluate
-	# helper functions
-	source += linear_activation
-	source += sigmoid_activation
-	source += relu_activation
-	# the network evaluation function
-	source += structure
-	for output in outputs:
-		source += output 
-	for weight in weights:
-		source += weight 
-	for bias in biases:
-		source += bias
-	source += controller_eval
-
-	# add log group for logging
-	# source += log_group
+	""")
 
+	code = source.getvalue()
 	if output_path:
-		with open(output_path, 'w') as f:
-			f.write(source)
+		with replace_atomically(output_path) as f:
+			f.write(code)
+	if emit_binary:
+		build_script = os.path.join(out_dir, "build.sh")
+		with replace_atomically(build_script) as f:
+			f.write(objcopy_build_script.format(names=" ".join(table_names)))
+			os.chmod(f.name, 0o755)
 
-	return source
\ No newline at end of file
+	return code
@@ -2,16 +2,17 @@
 
 import argparse
 import csv
+import hashlib
 import joblib
+import numpy as np
 import os
 import re
 import sys
-import shutil
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
-# Import TensorFlow
-import tensorflow as tf
 import yaml
 
 import quad_gen.gaussian_mlp as mlp
@@ -46,6 +47,41 @@ def read_txt_to_get_dirs(root_dir: str, txt: str) -> List[str]:
 	return sub_dirs
 
 
+def last_csv_row(csv_file: str, tail_bytes: int = 4096) -> Optional[Dict[str, str]]:
+	"""
+	Read the last row of a csv file without parsing the rows before it,
+	only the header and the last tail_bytes of the file are read
+	Args:
+		csv_file [str]: the csv file with a header line
+		tail_bytes [int]: (default 4096) how far from the end to look for the last row
+	Returns:
+		Optional[Dict[str, str]]: the last row keyed by the header, None if there are no rows
+	"""
+	with open(csv_file, 'rb') as f:
+		header = f.readline()
+		data_start = f.tell()
+		end = f.seek(0, os.SEEK_END)
+		start = max(data_start, end - tail_bytes)
+		f.seek(start)
+		tail = f.read().rstrip(b'\r\n')
+
+	newline = tail.rfind(b'\n')
+	line = tail[newline + 1:]
+	# the row must start inside the tail and be free of quoting, which may span lines
+	if (newline != -1 or start == data_start) and b'"' not in line:
+		if not line:
+			return None
+		names = next(csv.reader([header.decode()]))
+		fields = next(csv.reader([line.decode()]))
+		if len(fields) == len(names):
+			return dict(zip(names, fields))
+
+	# the tail heuristic failed, parse the whole file
+	with open(csv_file, 'r') as csvfile:
+		rows = list(csv.DictReader(csvfile))
+	return rows[-1] if rows else None
+
+
 def analyze_seeds(experiment: str) -> str:
 	"""
 	Find the seed directory with the highest average reward
@@ -74,18 +110,16 @@ def analyze_seeds(experiment: str) -> str:
 				print(f'Progress file not found in {seed_dir}, skipping...')
 				continue
 				
-			with open(progress_file, 'r') as csvfile:
-				progress_reader = csv.DictReader(csvfile)
-				rows = list(progress_reader)
-				if not rows:
-					print(f'No data found in progress.csv for {seed_dir}, skipping...')
-					continue
-					
-				main_reward_latest = rows[-1]['rewards/rew_main_avg']
-				if highest_reward <= float(main_reward_latest):
-					target_seed = seed_dir
-					best_seed = seed_dir_split[-1]
-					highest_reward = float(main_reward_latest)
+			last_row = last_csv_row(progress_file)
+			if last_row is None:
+				print(f'No data found in progress.csv for {seed_dir}, skipping...')
+				continue
+
+			main_reward_latest = last_row['rewards/rew_main_avg']
+			if highest_reward <= float(main_reward_latest):
+				target_seed = seed_dir
+				best_seed = seed_dir_split[-1]
+				highest_reward = float(main_reward_latest)
 
 	if not target_seed:
 		raise ValueError(f"No valid seed directories found in {experiment}")
@@ -94,7 +128,103 @@ def analyze_seeds(experiment: str) -> str:
 	return target_seed
 
 
-def save_result(model_dir: str, out_dir: str, osi: bool = False, absolute_path: bool = False) -> None:
+# layout version of the params.npz archives, archives of another version are rebuilt
+NPZ_FORMAT_VERSION = 2
+
+
+def params_to_npz(pkl_params: Any, npz_path: str, source_digest: Optional[str] = None) -> bool:
+	"""
+	Convert the contents of a Brax params.pkl, a (running_stats, policy_params,
+	value_params) tuple, into a numpy only .npz archive so later runs skip
+	unpickling it. The arrays are named running_stats.mean, running_stats.std
+	and policy.<key>.<key>... following the nesting of the policy parameters,
+	next to format_version holding NPZ_FORMAT_VERSION and source_digest. The
+	running_stats arrays are only written when the first element of the tuple
+	has a mean and a std
+	Args:
+		pkl_params [Any]: the unpickled params.pkl
+		npz_path [str]: the .npz file to write
+		source_digest [str, optional]: the sha256 hex digest of the params.pkl
+			the archive is converted from
+	Returns:
+		bool: False if the pickle is not in the tuple format (e.g. a TensorFlow policy)
+	"""
+	if not (isinstance(pkl_params, tuple) and len(pkl_params) >= 2):
+		return False
+
+	arrays: Dict[str, np.ndarray] = {'format_version': np.asarray(NPZ_FORMAT_VERSION)}
+	if source_digest is not None:
+		arrays['source_digest'] = np.asarray(source_digest)
+	# checkpoints without an observation normalizer have no running statistics
+	mean = getattr(pkl_params[0], 'mean', None)
+	std = getattr(pkl_params[0], 'std', None)
+	if mean is not None and std is not None:
+		arrays['running_stats.mean'] = np.asarray(mean)
+		arrays['running_stats.std'] = np.asarray(std)
+
+	def flatten(prefix: str, tree: Any) -> None:
+		for key in sorted(tree.keys()):
+			value = tree[key]
+			if hasattr(value, 'keys'):
+				flatten(f"{prefix}.{key}", value)
+			else:
+				arrays[f"{prefix}.{key}"] = np.asarray(value)
+
+	flatten('policy', pkl_params[1])
+
+	# an interrupted run or a concurrent reader never sees a partial archive
+	with mlp.replace_atomically(npz_path, 'wb') as f:
+		np.savez(f, **arrays)
+	return True
+
+
+def load_npz_params(
+	npz_path: str,
+	source_digest: Optional[str] = None,
+) -> Optional[Tuple[Dict[str, Any], Optional[np.ndarray], Optional[np.ndarray]]]:
+	"""
+	Load the archive written by params_to_npz
+	Args:
+		npz_path [str]: the .npz file
+		source_digest [str, optional]: the sha256 hex digest of the params.pkl
+			the archive must have been converted from
+	Returns:
+		Optional[Tuple[Dict[str, Any], Optional[np.ndarray], Optional[np.ndarray]]]:
+			the nested policy parameters and the mean and std of the observation
+			normalizer (None without one), None if the archive is not of the
+			current NPZ_FORMAT_VERSION or was converted from another params.pkl
+	"""
+	policy: Dict[str, Any] = {}
+	with np.load(npz_path) as arrays:
+		if 'format_version' not in arrays.files or int(arrays['format_version']) != NPZ_FORMAT_VERSION:
+			return None
+		if source_digest is not None and (
+			'source_digest' not in arrays.files or str(arrays['source_digest']) != source_digest
+		):
+			return None
+		for name in arrays.files:
+			group, *keys = name.split('.')
+			if group != 'policy' or not keys:
+				continue
+			node = policy
+			for key in keys[:-1]:
+				node = node.setdefault(key, {})
+			node[keys[-1]] = arrays[name]
+		mean = arrays['running_stats.mean'] if 'running_stats.mean' in arrays.files else None
+		std = arrays['running_stats.std'] if 'running_stats.std' in arrays.files else None
+	return policy, mean, std
+
+
+def save_result(
+	model_dir: str,
+	out_dir: str,
+	osi: bool = False,
+	absolute_path: bool = False,
+	precision: str = "float",
+	tanh: str = "lut",
+	transpose: bool = False,
+	emit_binary: bool = False,
+) -> None:
 	"""
 	Save the result of a model to a directory
 	Args:
@@ -103,6 +233,14 @@ def save_result(model_dir: str, out_dir: str, osi: bool = False, absolute_path:
 		osi [bool]: indicates whether the model is an osi
 		absolute_path [bool]: (default False) indicated whether the out_dir 
 			has been modified to the desired sub location
+		precision [str]: (default "float") numeric format of the generated network,
+			see gaussian_mlp.PRECISIONS
+		tanh [str]: (default "lut") tanh implementation of the generated network,
+			see gaussian_mlp.TANH_FUNCTIONS
+		transpose [bool]: (default False) emit the pre-transposed float layout,
+			see gaussian_mlp.generate
+		emit_binary [bool]: (default False) write the weights to .bin files linked
+			with objcopy instead of inline arrays, see gaussian_mlp.generate
 	"""
 	model_dir = model_dir.rstrip(os.sep)
 	out_dir = out_dir.rstrip(os.sep)
@@ -120,50 +258,136 @@ def save_result(model_dir: str, out_dir: str, osi: bool = False, absolute_path:
 	# Copy params.pkl file
 	params_src = os.path.join(model_dir, 'params.pkl')
 	params_dst = os.path.join(out_dir, 'params.pkl')
-	shutil.copyfile(params_src, params_dst)
+	# the digest ties params.npz to the params.pkl it was converted from
+	digest = hashlib.sha256()
+	with mlp.replace_atomically(params_dst, 'wb') as f, open(params_src, 'rb') as src:
+		for chunk in iter(lambda: src.read(1 << 20), b''):
+			digest.update(chunk)
+			f.write(chunk)
+	source_digest = digest.hexdigest()
 	
 	# shutil.copyfile(model_dir + '/config.yml', out_dir + '/config.yml')
 
-	# TensorFlow 2.x compatible session handling
+	# The tuple structure (running_stats, policy_params, value_params) is converted
+	# once to params.npz, later runs load the numpy arrays without unpickling
+	npz_path = os.path.join(out_dir, 'params.npz')
 	print(f"Extracting parameters from file {params_src} ...")
-	pkl_params = joblib.load(params_src)
-	
-	# Handle the tuple structure: (running_stats, policy_params, value_params)
-	if isinstance(pkl_params, tuple) and len(pkl_params) >= 2:
-		# The policy is the second element in the tuple
-		policy = pkl_params[1]
+	loaded = load_npz_params(npz_path, source_digest) if os.path.isfile(npz_path) else None
+	if loaded is None:
+		pkl_params = joblib.load(params_src)
+		if params_to_npz(pkl_params, npz_path, source_digest):
+			loaded = load_npz_params(npz_path, source_digest)
+	if loaded is not None:
+		# the observation normalizer is folded into the first layer of the network
+		policy, input_mean, input_std = loaded
 	else:
 		# Fallback to the original dictionary structure
 		policy = pkl_params['policy']
-
-	# For TensorFlow 2.x, we need to handle the session differently
-	# The mlp.generate function expects a session, so we'll create a TF 1.x compatible session
-	# This maintains backward compatibility with the existing mlp module
-	tf.compat.v1.disable_eager_execution()
-	with tf.compat.v1.Session() as sess:
-		mlp.generate(policy, sess, f"{out_dir}/network_evaluate.c")
+		input_mean = None
+		input_std = None
+
+	generate_kwargs = dict(
+		precision=precision,
+		tanh=tanh,
+		transpose=transpose,
+		input_mean=input_mean,
+		input_std=input_std,
+		emit_binary=emit_binary,
+	)
+	if hasattr(policy, 'get') and 'params' in policy:
+		# JAX/Flax parameters are plain arrays, no session is needed
+		mlp.generate(policy, None, f"{out_dir}/network_evaluate.c", **generate_kwargs)
+	else:
+		# The TensorFlow policy is evaluated in a TF 1.x compatible session,
+		# TensorFlow is only imported for this legacy path
+		import tensorflow as tf
+		tf.compat.v1.disable_eager_execution()
+		with tf.compat.v1.Session() as sess:
+			mlp.generate(policy, sess, f"{out_dir}/network_evaluate.c", **generate_kwargs)
 	print(f"C code generated successfully: {out_dir}/network_evaluate.c")
 
 
-def copy_by_best_seed(root_dir: str, out_dir: str) -> None:
+def save_results(
+	model_dirs: List[str],
+	out_dirs: List[str],
+	absolute_path: bool = False,
+	precision: str = "float",
+	tanh: str = "lut",
+	transpose: bool = False,
+	emit_binary: bool = False,
+) -> None:
+	"""
+	Run save_result for every model in a process pool, the models are independent
+	Args:
+		model_dirs [List[str]]: the directories containing the models
+		out_dirs [List[str]]: the output directory of each model
+		absolute_path [bool]: (default False) see save_result
+		precision [str]: numeric format of the generated networks
+		tanh [str]: tanh implementation of the generated networks
+		transpose [bool]: emit the pre-transposed float layout
+		emit_binary [bool]: write the weights to .bin files linked with objcopy
+	"""
+	with ProcessPoolExecutor() as ex:
+		# consume the results so an exception in a worker is raised here
+		list(ex.map(
+			save_result,
+			model_dirs,
+			out_dirs,
+			repeat(False),
+			repeat(absolute_path),
+			repeat(precision),
+			repeat(tanh),
+			repeat(transpose),
+			repeat(emit_binary),
+		))
+
+
+def copy_by_best_seed(
+	root_dir: str,
+	out_dir: str,
+	precision: str = "float",
+	tanh: str = "lut",
+	transpose: bool = False,
+	emit_binary: bool = False,
+) -> None:
 	"""
 	Copy models by selecting the best seed from each experiment
 	Args:
 		root_dir [str]: root directory containing experiments
 		out_dir [str]: output directory for saved models
+		precision [str]: numeric format of the generated networks
+		tanh [str]: tanh implementation of the generated networks
+		transpose [bool]: emit the pre-transposed float layout
+		emit_binary [bool]: write the weights to .bin files linked with objcopy
 	"""
 	print(f'Searching root {root_dir} ...')
 	print('================================')
 	subdirs = subdir(root_dir)
 
+	target_seeds = []
 	for experiment in subdirs:
 		print(f'Searching subdir {experiment} ... Analyzing seeds')
 		# grab the seed with the highest average reward
-		target_seed = analyze_seeds(experiment)
-		save_result(target_seed, out_dir)
+		target_seeds.append(analyze_seeds(experiment))
+	save_results(
+		target_seeds,
+		[out_dir] * len(target_seeds),
+		precision=precision,
+		tanh=tanh,
+		transpose=transpose,
+		emit_binary=emit_binary,
+	)
 
 
-def copy_by_txt(root_dir: str, out_dir: str, txt: str) -> None:
+def copy_by_txt(
+	root_dir: str,
+	out_dir: str,
+	txt: str,
+	precision: str = "float",
+	tanh: str = "lut",
+	transpose: bool = False,
+	emit_binary: bool = False,
+) -> None:
 	"""
 	Copy the models specified in a txt file
 	All the models must be located under the root_dir
@@ -171,6 +395,10 @@ def copy_by_txt(root_dir: str, out_dir: str, txt: str) -> None:
 		root_dir [str]: the root directory
 		out_dir [str]: the output directory [will create one if it doesn't exist]
 		txt [str]: the txt file specifying the model relative directories
+		precision [str]: numeric format of the generated networks
+		tanh [str]: tanh implementation of the generated networks
+		transpose [bool]: emit the pre-transposed float layout
+		emit_binary [bool]: write the weights to .bin files linked with objcopy
 	"""
 	print(f'Searching root {root_dir} ...')
 	print('================================')
@@ -178,30 +406,59 @@ def copy_by_txt(root_dir: str, out_dir: str, txt: str) -> None:
 	subdirs = read_txt_to_get_dirs(root_dir, txt)
 	for experiment in subdirs:
 		print(f'Copying params.pkl from {experiment} to {out_dir}...')
-		save_result(experiment, out_dir)
+	save_results(
+		subdirs,
+		[out_dir] * len(subdirs),
+		precision=precision,
+		tanh=tanh,
+		transpose=transpose,
+		emit_binary=emit_binary,
+	)
 
 
-def traverse_root(root_dir: str, out_dir: str) -> None:
+def traverse_root(
+	root_dir: str,
+	out_dir: str,
+	precision: str = "float",
+	tanh: str = "lut",
+	transpose: bool = False,
+	emit_binary: bool = False,
+) -> None:
 	"""
-	Recursively search for pickle files of models and 
-	convert the model if found
+	Search the subdirectories for pickle files of models and
+	convert the models found, a directory with a model is not searched further
 
 	Args:
 		root_dir [str]: the root directory
 		out_dir [str]: the output directory [will create one if it doesn't exist]
+		precision [str]: numeric format of the generated networks
+		tanh [str]: tanh implementation of the generated networks
+		transpose [bool]: emit the pre-transposed float layout
+		emit_binary [bool]: write the weights to .bin files linked with objcopy
 	"""
-	subdirs = subdir(root_dir)
-	for path in subdirs:
+	model_dirs = []
+	save_paths = []
+	for path, dirnames, filenames in os.walk(root_dir, followlinks=True):
 		path = path.rstrip(os.sep)
-		params_file = os.path.join(path, 'params.pkl')
-		if os.path.isfile(params_file):
-			# -5 is picked appropriately
-			save_path = '/'.join([i for i in path.split('/')[-5:]])
-			save_path = f"{out_dir.rstrip(os.sep)}/{save_path}"
-			print(f'Copying params.pkl from {path} to {save_path}...')
-			save_result(path, save_path, absolute_path=True)
-		else:
-			traverse_root(path, out_dir)
+		# the root itself is not a model, only its subdirectories are
+		if path == root_dir.rstrip(os.sep) or 'params.pkl' not in filenames:
+			continue
+		dirnames.clear()
+		# -5 is picked appropriately
+		save_path = '/'.join([i for i in path.split('/')[-5:]])
+		save_path = f"{out_dir.rstrip(os.sep)}/{save_path}"
+		print(f'Copying params.pkl from {path} to {save_path}...')
+		model_dirs.append(path)
+		save_paths.append(save_path)
+	save_results(
+		model_dirs,
+		save_paths,
+		absolute_path=True,
+		precision=precision,
+		tanh=tanh,
+		transpose=transpose,
+		emit_binary=emit_binary,
+	)
 
 
 def main(args: argparse.Namespace) -> None:
@@ -209,11 +466,11 @@ def main(args: argparse.Namespace) -> None:
 	if args.mode == 0:
 		if not args.txt:
 			raise ValueError("Mode 0 requires a txt file to be specified with -txt")
-		copy_by_txt(args.root_dir, args.out_dir, args.txt)
+		copy_by_txt(args.root_dir, args.out_dir, args.txt, args.precision, args.tanh, args.transpose, args.emit_binary)
 	elif args.mode == 1:
-		copy_by_best_seed(args.root_dir, args.out_dir)
+		copy_by_best_seed(args.root_dir, args.out_dir, args.precision, args.tanh, args.transpose, args.emit_binary)
 	elif args.mode == 2:
-		traverse_root(args.root_dir, args.out_dir)
+		traverse_root(args.root_dir, args.out_dir, args.precision, args.tanh, args.transpose, args.emit_binary)
 	else:
 		raise ValueError(f"Invalid mode: {args.mode}. Must be 0, 1, or 2.")
 
@@ -248,6 +505,43 @@ if __name__ == "__main__":
 		help='txt file that contains all the models'
 	)
 
+	parser.add_argument(
+		'-precision',
+		type=str,
+		default='float',
+		choices=mlp.PRECISIONS,
+		help='numeric format of the generated network.\n'
+			 'float: float32 weights and activations\n'
+			 'int8: per-layer int8 weights and activations with int32 accumulation\n'
+			 'fixed: integer only network, Q1.15 activations and a tanh lookup table\n',
+	)
+
+	parser.add_argument(
+		'-tanh',
+		type=str,
+		default='lut',
+		choices=tuple(mlp.TANH_FUNCTIONS),
+		help='tanh implementation of the float and int8 networks.\n'
+			 'tanhf: libm tanhf\n'
+			 'fast: clamped Pade approximant, a few FMAs and one division\n'
+			 'lut: linear interpolation in a 1025 entry table over [-4, 4]\n',
+	)
+
+	parser.add_argument(
+		'-transpose',
+		action='store_true',
+		help='float networks only: keep the original output-major loop order over\n'
+			 'weights stored pre-transposed, bit-exact with the original loops only\n'
+			 'with -tanh tanhf and a checkpoint without an observation normalizer\n',
+	)
+
+	parser.add_argument(
+		'-emit_binary',
+		action='store_true',
+		help='write the weights and biases to raw .bin files declared extern in\n'
+			 'network_evaluate.c, build.sh converts them into objects with objcopy\n',
+	)
+
 	args = parser.parse_args() 
 
 	main(args)
\ No newline at end of file
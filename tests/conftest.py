@@ -0,0 +1,25 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# make quad_gen importable when pytest runs from any directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# layer widths of the synthetic policy, state -> hidden layers -> trailing matrix;
+# odd widths exercise the padding of every layer
+WIDTHS = (13, 30, 27, 30, 30, 8)
+
+
+@pytest.fixture(scope="session")
+def policy():
+	"""A Brax style {'params': {'hidden_n': {'kernel', 'bias'}}} policy with random weights"""
+	rng = np.random.default_rng(1)
+	return {'params': {
+		f'hidden_{n}': {
+			'kernel': rng.normal(scale=0.4, size=(WIDTHS[n], WIDTHS[n + 1])).astype(np.float32),
+			'bias': rng.normal(scale=0.3, size=WIDTHS[n + 1]).astype(np.float32),
+		}
+		for n in range(len(WIDTHS) - 1)
+	}}
@@ -0,0 +1,138 @@
+"""
+Generates every variant of the network from the synthetic policy, compiles it
+with the host C compiler and compares its controls to a numpy forward pass,
+skipped when no `cc` is installed
+"""
+import os
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+
+import quad_gen.gaussian_mlp as mlp
+
+# reads states from stdin and prints the controls networkEvaluate writes
+DRIVER = r"""
+#include <math.h>
+#include <stdio.h>
+#include <stdint.h>
+#include "{path}"
+
+int main(void) {{
+	float state[13];
+	float control[{n_outputs}];
+	while (1) {{
+		for (int i = 0; i < 13; i++) {{
+			if (scanf("%f", &state[i]) != 1) return 0;
+		}}
+		networkEvaluate(state, control);
+		for (int i = 0; i < {n_outputs}; i++) printf("%.9g ", control[i]);
+		printf("\n");
+	}}
+}}
+"""
+
+# largest difference to the float64 reference accepted for each variant, a few
+# times the error measured on the synthetic policy, whose outputs reach about 5
+TOLERANCES = {
+	("float", "tanhf"): 1e-5,
+	("float", "lut"): 2e-3,
+	("float", "fast"): 0.3,
+	("int8", "tanhf"): 0.25,
+	("int8", "lut"): 0.25,
+	("int8", "fast"): 0.4,
+	# the fixed network always uses its Q1.15 tanh table
+	("fixed", "lut"): 1e-2,
+}
+
+VARIANTS = [
+	(precision, tanh, False) for precision, tanh in TOLERANCES
+] + [("float", tanh, True) for tanh in mlp.TANH_FUNCTIONS]
+
+requires_cc = pytest.mark.skipif(shutil.which("cc") is None, reason="no C compiler")
+
+
+def reference(policy, states, input_mean=None, input_std=None):
+	"""The float64 forward pass networkEvaluate implements"""
+	params = policy['params']
+	h = np.asarray(states, np.float64)
+	if input_mean is not None:
+		h = (h - input_mean) / input_std
+	# the trailing hidden layer is not evaluated by networkEvaluate
+	last = len(params) - 2
+	for n in range(last + 1):
+		h = h @ params[f'hidden_{n}']['kernel'].astype(np.float64) + params[f'hidden_{n}']['bias']
+		if n != last:
+			h = np.tanh(h)
+	return h[:, :mlp.N_OUTPUTS]
+
+
+def evaluate(tmp_path, states, cflags=()):
+	"""Compile network_evaluate.c in tmp_path with the driver and run it on states"""
+	driver = tmp_path / "driver.c"
+	driver.write_text(DRIVER.format(path=tmp_path / "network_evaluate.c", n_outputs=mlp.N_OUTPUTS))
+	exe = tmp_path / "driver"
+	subprocess.run(
+		["cc", "-std=c11", "-O2", *cflags, str(driver), "-o", str(exe), "-lm"],
+		capture_output=True, text=True, check=True,
+	)
+	stdin = "\n".join(" ".join(f"{v:.9g}" for v in row) for row in states)
+	stdout = subprocess.run([str(exe)], input=stdin, capture_output=True, text=True, check=True).stdout
+	return np.array([[float(v) for v in line.split()] for line in stdout.splitlines()])
+
+
+@requires_cc
+@pytest.mark.parametrize("normalize", [False, True], ids=["raw", "normalized"])
+@pytest.mark.parametrize("precision,tanh,transpose", VARIANTS)
+def test_network_matches_numpy(tmp_path, policy, precision, tanh, transpose, normalize):
+	rng = np.random.default_rng(0)
+	input_mean = input_std = None
+	states = rng.normal(scale=0.5, size=(200, 13))
+	if normalize:
+		input_mean = rng.normal(size=13)
+		input_std = rng.uniform(0.5, 2.0, size=13)
+		states = input_mean + input_std * states
+	mlp.generate(
+		policy, None, str(tmp_path / "network_evaluate.c"), precision=precision, tanh=tanh,
+		transpose=transpose, input_mean=input_mean, input_std=input_std,
+	)
+	error = np.abs(evaluate(tmp_path, states) - reference(policy, states, input_mean, input_std)).max()
+	assert error < TOLERANCES[(precision, tanh)]
+
+
+def sanitizer_flags():
+	"""-fsanitize=undefined aborting on the first report, if cc can link it"""
+	flags = ["-fsanitize=undefined", "-fno-sanitize-recover=undefined"]
+	probe = subprocess.run(
+		["cc", *flags, "-x", "c", "-", "-o", os.devnull], input="int main(void) { return 0; }",
+		capture_output=True, text=True,
+	)
+	return flags if probe.returncode == 0 else []
+
+
+@requires_cc
+@pytest.mark.parametrize("precision,tanh,transpose", VARIANTS)
+def test_network_survives_non_finite_state(tmp_path, policy, precision, tanh, transpose):
+	# a bad sensor sample must not index the tables out of bounds or crash
+	states = np.zeros((4, 13))
+	states[0, 3] = np.nan
+	states[1, 3] = np.inf
+	states[2, 3] = -np.inf
+	states[3] = np.nan
+	mlp.generate(policy, None, str(tmp_path / "network_evaluate.c"), precision=precision, tanh=tanh, transpose=transpose)
+	controls = evaluate(tmp_path, states, sanitizer_flags())
+	assert controls.shape == (len(states), mlp.N_OUTPUTS)
+
+
+@pytest.mark.filterwarnings("ignore:divide by zero:RuntimeWarning", "ignore:invalid value:RuntimeWarning")
+@pytest.mark.parametrize("emit_binary", [False, True], ids=["inline", "binary"])
+def test_zero_input_std_is_rejected(tmp_path, policy, emit_binary):
+	# folding (x - mean) / std with a zero std gives infinite first layer weights
+	input_std = np.ones(13)
+	input_std[3] = 0.0
+	with pytest.raises(ValueError, match="non-finite"):
+		mlp.generate(
+			policy, None, str(tmp_path / "network_evaluate.c"),
+			input_mean=np.zeros(13), input_std=input_std, emit_binary=emit_binary,
+		)
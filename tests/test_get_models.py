@@ -0,0 +1,129 @@
+import collections
+import csv
+import os
+
+import joblib
+import numpy as np
+import pytest
+
+import quad_gen.get_models as get_models
+
+RunningStats = collections.namedtuple('RunningStats', ['mean', 'std'])
+
+HEADER = "step,reward,seed\n"
+ROWS = "".join(f"{i},{i * 0.5},3\n" for i in range(1000))
+
+
+def dict_reader_last_row(csv_file):
+	with open(csv_file, 'r') as f:
+		rows = list(csv.DictReader(f))
+	return rows[-1] if rows else None
+
+
+@pytest.mark.parametrize("content", [
+	pytest.param(HEADER + ROWS, id="trailing-newline"),
+	pytest.param(HEADER + ROWS.rstrip("\n"), id="no-trailing-newline"),
+	pytest.param((HEADER + ROWS).replace("\n", "\r\n"), id="crlf"),
+	pytest.param(HEADER + "0,1.5,3\n", id="single-row"),
+	pytest.param(HEADER + ROWS + '1000,"2,5",3\n', id="quoted-last-row"),
+	pytest.param(HEADER + ROWS + f"1000,{'9' * 5000},3\n", id="row-longer-than-tail"),
+])
+def test_last_csv_row_matches_dict_reader(tmp_path, content):
+	csv_file = tmp_path / "progress.csv"
+	csv_file.write_bytes(content.encode())
+	row = get_models.last_csv_row(str(csv_file))
+	assert row is not None
+	assert row == dict_reader_last_row(csv_file)
+
+
+@pytest.mark.parametrize("content", ["", HEADER, HEADER + "\n"], ids=["empty", "header-only", "header-blank-line"])
+def test_last_csv_row_without_rows(tmp_path, content):
+	csv_file = tmp_path / "progress.csv"
+	csv_file.write_text(content)
+	assert get_models.last_csv_row(str(csv_file)) is None
+
+
+@pytest.fixture
+def policy_params():
+	rng = np.random.default_rng(0)
+	return {'params': {
+		'hidden_0': {'kernel': rng.normal(size=(13, 8)).astype(np.float32), 'bias': np.zeros(8, np.float32)},
+		'hidden_1': {'kernel': rng.normal(size=(8, 4)).astype(np.float32), 'bias': np.ones(4, np.float32)},
+	}}
+
+
+def assert_same_tree(loaded, expected):
+	assert loaded.keys() == expected.keys()
+	for key, value in expected.items():
+		if isinstance(value, dict):
+			assert_same_tree(loaded[key], value)
+		else:
+			np.testing.assert_array_equal(loaded[key], value)
+
+
+def test_npz_round_trip(tmp_path, policy_params):
+	npz_path = str(tmp_path / "params.npz")
+	stats = RunningStats(mean=np.arange(13.0), std=np.full(13, 2.0))
+	assert get_models.params_to_npz((stats, policy_params, None), npz_path)
+
+	policy, mean, std = get_models.load_npz_params(npz_path)
+	assert_same_tree(policy, policy_params)
+	np.testing.assert_array_equal(mean, stats.mean)
+	np.testing.assert_array_equal(std, stats.std)
+
+
+def test_npz_round_trip_without_running_stats(tmp_path, policy_params):
+	npz_path = str(tmp_path / "params.npz")
+	assert get_models.params_to_npz((None, policy_params), npz_path)
+
+	policy, mean, std = get_models.load_npz_params(npz_path)
+	assert_same_tree(policy, policy_params)
+	assert mean is None and std is None
+
+
+def test_params_to_npz_rejects_other_pickles(tmp_path, policy_params):
+	npz_path = tmp_path / "params.npz"
+	assert not get_models.params_to_npz(policy_params, str(npz_path))
+	assert not npz_path.exists()
+
+
+@pytest.mark.parametrize("version", [None, get_models.NPZ_FORMAT_VERSION + 1], ids=["missing", "newer"])
+def test_load_npz_params_rejects_other_versions(tmp_path, version):
+	npz_path = tmp_path / "params.npz"
+	arrays = {'policy.params.hidden_0.kernel': np.zeros((13, 8))}
+	if version is not None:
+		arrays['format_version'] = np.asarray(version)
+	np.savez(npz_path, **arrays)
+	assert get_models.load_npz_params(str(npz_path)) is None
+
+
+def test_load_npz_params_rejects_other_sources(tmp_path, policy_params):
+	npz_path = str(tmp_path / "params.npz")
+	assert get_models.params_to_npz((None, policy_params), npz_path, "a" * 64)
+	assert get_models.load_npz_params(npz_path, "a" * 64) is not None
+	assert get_models.load_npz_params(npz_path, "b" * 64) is None
+
+	# archives written without a digest are not trusted against a source
+	assert get_models.params_to_npz((None, policy_params), npz_path)
+	assert get_models.load_npz_params(npz_path, "a" * 64) is None
+
+
+def test_save_result_rebuilds_npz_of_another_model(tmp_path, policy):
+	# model b is older than the archive of model a, as after rsync -a or cp -p
+	out_dir = tmp_path / "out"
+	sources = {}
+	for name, scale in (("a", 1.0), ("b", 2.0)):
+		model_dir = tmp_path / name
+		model_dir.mkdir()
+		params = {'params': {
+			layer: {key: value * scale for key, value in arrays.items()}
+			for layer, arrays in policy['params'].items()
+		}}
+		joblib.dump((None, params, None), model_dir / "params.pkl")
+		os.utime(model_dir / "params.pkl", (0, 0))
+		sources[name] = params
+
+	for name in ("a", "b"):
+		get_models.save_result(str(tmp_path / name), str(out_dir), absolute_path=True)
+		loaded = get_models.load_npz_params(str(out_dir / "params.npz"))
+		assert_same_tree(loaded[0], sources[name])
@@ -0,0 +1,90 @@
+"""
+Compile-only checks of the NEON matmul kernel of the float network for ARM
+targets, skipped when no ARM capable C compiler is installed
+"""
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+import quad_gen.gaussian_mlp as mlp
+
+# libm prototypes, so the generated code compiles freestanding without a sysroot
+WRAPPER = """
+float tanhf(float);
+float fabsf(float);
+float fmaxf(float, float);
+float fminf(float, float);
+double exp(double);
+#include "{path}"
+"""
+
+# target: (flags per compiler, intrinsic NEON_FMA must select, instruction expected in the assembly)
+TARGETS = {
+	"aarch64": (
+		{"clang": ["--target=aarch64-linux-gnu"], "gcc": [], "zig": ["-target", "aarch64-linux-musl"]},
+		"vfmaq_f32", "fmla",
+	),
+	"armv7-vfpv4": (
+		{
+			"clang": ["--target=armv7a-linux-gnueabihf", "-mcpu=cortex-a7", "-mfpu=neon-vfpv4"],
+			"gcc": ["-mcpu=cortex-a7", "-mfpu=neon-vfpv4", "-mfloat-abi=hard"],
+			"zig": ["-target", "arm-linux-musleabihf", "-mcpu=cortex_a7"],
+		},
+		"vfmaq_f32", "vfma",
+	),
+	"armv7-neon": (
+		{
+			"clang": ["--target=armv7a-linux-gnueabihf", "-mcpu=cortex-a8", "-mfpu=neon"],
+			"gcc": ["-mcpu=cortex-a8", "-mfpu=neon", "-mfloat-abi=hard"],
+			"zig": ["-target", "arm-linux-musleabihf", "-mcpu=cortex_a8+neon"],
+		},
+		# without VFPv4 there is no fused multiply-add, compilers may split vmla
+		"vmlaq_f32", None,
+	),
+}
+
+
+def compilers():
+	"""The ARM capable C compilers found, as (kind, target, command)"""
+	found = []
+	if shutil.which("clang"):
+		found += [("clang", target, ["clang"]) for target in TARGETS]
+	if shutil.which("aarch64-linux-gnu-gcc"):
+		found.append(("gcc", "aarch64", ["aarch64-linux-gnu-gcc"]))
+	if shutil.which("arm-linux-gnueabihf-gcc"):
+		found += [("gcc", target, ["arm-linux-gnueabihf-gcc"]) for target in ("armv7-vfpv4", "armv7-neon")]
+	try:
+		import ziglang  # noqa: F401
+		# zig cc passes -c along with -S
+		zig = [sys.executable, "-m", "ziglang", "cc", "-Wno-unused-command-line-argument"]
+		found += [("zig", target, zig) for target in TARGETS]
+	except ImportError:
+		pass
+	return found
+
+
+NO_COMPILER = [pytest.param(None, None, None, marks=pytest.mark.skip(reason="no ARM C compiler"))]
+
+
+@pytest.mark.parametrize("kind,target,command", compilers() or NO_COMPILER)
+def test_neon_kernel_compiles(tmp_path, policy, kind, target, command):
+	flags, intrinsic, instruction = TARGETS[target]
+	source = tmp_path / "network_evaluate.c"
+	mlp.generate(policy, None, str(source))
+	wrapper = tmp_path / "wrapper.c"
+	wrapper.write_text(WRAPPER.format(path=source))
+	cflags = [*flags[kind], "-O2", "-std=c11", "-ffreestanding", "-Werror", "-Wno-unused-function"]
+
+	# the preprocessed networkEvaluate must use the intrinsic picked for the target
+	preprocessed = subprocess.run(
+		[*command, *cflags, "-E", str(wrapper)], capture_output=True, text=True, check=True,
+	).stdout
+	body = preprocessed[preprocessed.index("void networkEvaluate"):]
+	assert f"{intrinsic}(" in body
+
+	assembly = tmp_path / "network_evaluate.s"
+	subprocess.run([*command, *cflags, "-S", str(wrapper), "-o", str(assembly)], capture_output=True, text=True, check=True)
+	if instruction:
+		assert instruction in assembly.read_text()